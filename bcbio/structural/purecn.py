@@ -2,12 +2,16 @@
 
 https://github.com/lima1/PureCN
 """
+import csv
+import functools
+import hashlib
+import importlib.util
+import itertools
 import os
 import re
 import shutil
 import subprocess
 
-import pandas as pd
 import toolz as tz
 
 from bcbio import utils
@@ -15,10 +19,8 @@ from bcbio.heterogeneity import chromhacks
 from bcbio.log import logger
 from bcbio.pipeline import datadict as dd
 from bcbio.distributed.transaction import file_transaction
-from bcbio.heterogeneity import loh
 from bcbio.provenance import do
 from bcbio.variation import germline, vcfutils
-from bcbio.structural import cnvkit, gatkcnv
 
 def run(items):
     paired = vcfutils.get_paired(items)
@@ -36,6 +38,7 @@ def run(items):
     if purecn_out:
         purecn_out["variantcaller"] = "purecn"
         if "loh" in purecn_out:
+            from bcbio.heterogeneity import loh
             from bcbio.structural import titancna
             purecn_out["vrn_file"] = titancna.to_vcf(purecn_out["loh"], "PureCN", _get_header, _loh_to_vcf,
                                                      paired.tumor_data, sep=",")
@@ -55,28 +58,48 @@ def _run_purecn_dx(out, paired):
             cmd = ["PureCN_Dx.R", "--rds", out["rds"], "--callable", dd.get_sample_callable(paired.tumor_data),
                    "--signatures", "--out", tx_out_base]
             do.run(cmd, "PureCN Dx mutational burden and signatures")
-            for f in all_files:
-                if os.path.exists(os.path.join(os.path.dirname(tx_out_base), f)):
-                    shutil.move(os.path.join(os.path.dirname(tx_out_base), f),
-                                os.path.join(os.path.dirname(out_base), f))
+            _move_outputs(all_files, tx_out_base, out_base)
     return out
 
+def _move_outputs(all_files, tx_out_base, out_base):
+    """Move generated outputs from the transactional directory to the final directory.
+
+    Uses an atomic rename when both are on the same filesystem, falling back
+    to shutil.move (which copies in-kernel with sendfile on Linux) across devices.
+    """
+    for f in all_files:
+        tx_file = os.path.join(os.path.dirname(tx_out_base), f)
+        if os.path.exists(tx_file):
+            out_file = os.path.join(os.path.dirname(out_base), f)
+            try:
+                os.replace(tx_file, out_file)
+            except OSError:
+                shutil.move(tx_file, out_file)
+
 def _get_purecn_dx_files(paired, out):
     """Retrieve files generated by PureCN_Dx
     """
-    out_base = "%s-dx" % utils.splitext_plus(out["rds"])[0]
+    out_base, dx_files = _purecn_dx_file_names(out["rds"])
     all_files = []
-    for key, ext in [[("mutation_burden",), "_mutation_burden.csv"],
-                     [("plot", "signatures"), "_signatures.pdf"],
-                     [("signatures",), "_signatures.csv"]]:
-        cur_file = "%s%s" % (out_base, ext)
+    for key, cur_file in dx_files:
         out = tz.update_in(out, key, lambda x: cur_file)
         all_files.append(os.path.basename(cur_file))
     return out_base, out, all_files
 
+@functools.lru_cache(maxsize=None)
+def _purecn_dx_file_names(rds_file):
+    """Cached base name and (key, file) pairs for PureCN_Dx outputs of an rds file.
+    """
+    out_base = "%s-dx" % utils.splitext_plus(rds_file)[0]
+    return out_base, tuple((key, "%s%s" % (out_base, ext))
+                           for key, ext in [[("mutation_burden",), "_mutation_burden.csv"],
+                                            [("plot", "signatures"), "_signatures.pdf"],
+                                            [("signatures",), "_signatures.csv"]])
+
 def _run_purecn(paired, work_dir):
     """Run PureCN.R wrapper with pre-segmented CNVkit or GATK4 inputs.
     """
+    from bcbio.structural import cnvkit
     segfns = {"cnvkit": _segment_normalized_cnvkit, "gatk-cnv": _segment_normalized_gatk}
     out_base, out, all_files = _get_purecn_files(paired, work_dir)
     failed_file = out_base + "-failed.log"
@@ -111,10 +134,7 @@ def _run_purecn(paired, work_dir):
                 else:
                     logger.exception()
                     raise
-            for f in all_files:
-                if os.path.exists(os.path.join(os.path.dirname(tx_out_base), f)):
-                    shutil.move(os.path.join(os.path.dirname(tx_out_base), f),
-                                os.path.join(os.path.dirname(out_base), f))
+            _move_outputs(all_files, tx_out_base, out_base)
     out = _get_purecn_files(paired, work_dir, require_exist=True)[1]
     return out if (out.get("rds") and os.path.exists(out["rds"])) else None
 
@@ -127,33 +147,127 @@ def _allowed_errors(msg):
 def _segment_normalized_gatk(cnr_file, work_dir, paired):
     """Segmentation of normalized inputs using GATK4, converting into standard input formats.
     """
+    from bcbio.structural import gatkcnv
     work_dir = utils.safe_makedir(os.path.join(work_dir, "gatk-cnv"))
     seg_file = gatkcnv.model_segments(cnr_file, work_dir, paired)["seg"]
     std_seg_file = seg_file.replace(".cr.seg", ".seg")
     if not utils.file_uptodate(std_seg_file, seg_file):
         with file_transaction(std_seg_file) as tx_out_file:
-            df = pd.read_csv(seg_file, sep="\t", comment="@", header=0,
-                             names=["chrom", "loc.start", "loc.end", "num.mark", "seg.mean"])
-            df.insert(0, "ID", [dd.get_sample_name(paired.tumor_data)] * len(df))
-            df.to_csv(tx_out_file, sep="\t", header=True, index=False)
+            df = _read_tsv(seg_file, comment="@",
+                           names=["chrom", "loc.start", "loc.end", "num.mark", "seg.mean"])
+            df.insert(0, "ID", dd.get_sample_name(paired.tumor_data))
+            _write_tsv(df, tx_out_file)
     std_cnr_file = os.path.join(work_dir, "%s.cnr" % dd.get_sample_name(paired.tumor_data))
     if not utils.file_uptodate(std_cnr_file, cnr_file):
         with file_transaction(std_cnr_file) as tx_out_file:
-            logdf = pd.read_csv(cnr_file, sep="\t", comment="@", header=0,
-                                names=["chrom", "start", "end", "log2"])
-            covdf = pd.read_csv(tz.get_in(["depth", "bins", "antitarget"], paired.tumor_data),
-                                sep="\t", header=None,
-                                names=["chrom", "start", "end", "orig.name", "depth", "gene"])
-            df = pd.merge(logdf, covdf, on=["chrom", "start", "end"])
-            del df["orig.name"]
-            df = df[["chrom", "start", "end", "gene", "log2", "depth"]]
-            df.insert(6, "weight", [1.0] * len(df))
-            df.to_csv(tx_out_file, sep="\t", header=True, index=False)
+            cov_file = tz.get_in(["depth", "bins", "antitarget"], paired.tumor_data)
+            if "purecn_polars" in dd.get_tools_on(paired.tumor_data) and _polars_supported():
+                _normalize_cnr_polars(cnr_file, cov_file, tx_out_file)
+            else:
+                _normalize_cnr_pandas(cnr_file, cov_file, tx_out_file)
     return std_cnr_file, std_seg_file
 
+def _normalize_cnr_pandas(cnr_file, cov_file, out_file):
+    """Combine GATK log2 ratios with coverage depth into a CNVkit style CNR file using pandas.
+    """
+    import pandas as pd
+    keys = ["chrom", "start", "end"]
+    logdf = _read_tsv(cnr_file, comment="@", names=keys + ["log2"])
+    covdf = _read_tsv(cov_file, header=False, names=keys + ["orig.name", "depth", "gene"])
+    del covdf["orig.name"]
+    # merge validation is available in older pandas releases than DataFrame.join validation
+    df = pd.merge(logdf, covdf, on=keys, how="inner", validate="one_to_one")
+    df = df[["chrom", "start", "end", "gene", "log2", "depth"]]
+    df["weight"] = 1.0
+    _write_tsv(df, out_file)
+
+def _normalize_cnr_polars(cnr_file, cov_file, out_file):
+    """Combine GATK log2 ratios with coverage depth using a streaming Polars join.
+
+    Output is equivalent to, but not byte-identical with, the pandas approach:
+    Polars writes floats in positional notation (0.00001 instead of 1e-05) and
+    keeps NA gene names as written instead of converting them to empty values.
+    """
+    import polars as pl
+    keys = ["chrom", "start", "end"]
+    # Keep chromosomes as strings so numeric contigs (GRCh37 1-22) join with X/Y
+    logdf = pl.scan_csv(cnr_file, separator="\t", comment_prefix="@", has_header=True,
+                        new_columns=keys + ["log2"], schema_overrides={"chrom": pl.Utf8})
+    covdf = pl.scan_csv(cov_file, separator="\t", has_header=False,
+                        new_columns=keys + ["orig.name", "depth", "gene"],
+                        schema_overrides={"chrom": pl.Utf8})
+    (logdf.join(covdf.select(keys + ["depth", "gene"]), on=keys, how="inner", validate="1:1")
+     .with_columns(pl.lit(1.0).alias("weight"))
+     .select(["chrom", "start", "end", "gene", "log2", "depth", "weight"])
+     .sink_csv(out_file, separator="\t"))
+
+def _polars_supported():
+    """Check for Polars 0.20.31 or later, needed for schema_overrides in scan_csv.
+
+    Older releases also lack comment_prefix and join validation, so fall back to pandas.
+    """
+    if not _has_module("polars"):
+        logger.info("purecn_polars requested but polars is not installed, using pandas")
+        return False
+    import polars as pl
+    version = tuple(int(re.match(r"\d*", x).group() or 0) for x in pl.__version__.split(".")[:3])
+    if version < (0, 20, 31):
+        logger.info("purecn_polars requires polars 0.20.31 or later, found %s; using pandas" % pl.__version__)
+        return False
+    return True
+
+def _read_tsv(in_file, names, header=True, comment=None):
+    """Read a tab separated file, using the multithreaded Arrow parser when available.
+
+    The Arrow engine supports neither comments nor skipping rows before a header,
+    so leading comment lines (GATK SAM style @ headers) and the header line are
+    skipped by count. Chromosomes stay strings for numeric contigs (GRCh37 1-22).
+    Files without data rows use the C engine, which returns an empty frame where
+    the Arrow engine fails to infer the number of columns.
+    """
+    import pandas as pd
+    skiprows = _count_leading_comments(in_file, comment) if comment else 0
+    if header:
+        skiprows += 1
+    engine = "pyarrow" if _has_arrow_engine(pd) and _has_rows_after(in_file, skiprows) else None
+    return pd.read_csv(in_file, sep="\t", header=None, names=names, skiprows=skiprows,
+                       dtype={"chrom": str}, engine=engine)
+
+def _has_arrow_engine(pd):
+    """The pyarrow read_csv engine is stable from pandas 2.0 and needs pyarrow installed.
+    """
+    return tuple(int(x) for x in pd.__version__.split(".")[:2]) >= (2, 0) and _has_module("pyarrow")
+
+def _has_rows_after(in_file, skiprows):
+    with open(in_file) as in_handle:
+        return any(line.strip() for line in itertools.islice(in_handle, skiprows, None))
+
+def _count_leading_comments(in_file, comment):
+    count = 0
+    with open(in_file) as in_handle:
+        for line in in_handle:
+            if not line.startswith(comment):
+                break
+            count += 1
+    return count
+
+def _write_tsv(df, out_file):
+    """Write a data frame as unquoted tab separated output.
+
+    Uses pandas for all outputs; the Arrow CSV writer quotes headers and formats
+    floats differently (1 instead of 1.0), making outputs depend on installed packages.
+    """
+    df.to_csv(out_file, sep="\t", header=True, index=False, quoting=csv.QUOTE_NONE)
+
+def _has_module(name):
+    """Check for an optional dependency without paying the cost of importing it.
+    """
+    return importlib.util.find_spec(name) is not None
+
 def _segment_normalized_cnvkit(cnr_file, work_dir, paired):
     """Segmentation of normalized inputs using CNVkit.
     """
+    from bcbio.structural import cnvkit
     cnvkit_base = os.path.join(utils.safe_makedir(os.path.join(work_dir, "cnvkit")),
                                 dd.get_sample_name(paired.tumor_data))
     cnr_file = chromhacks.bed_to_standardonly(cnr_file, paired.tumor_data, headers="chromosome",
@@ -166,48 +280,79 @@ def _segment_normalized_cnvkit(cnr_file, work_dir, paired):
 def _remove_overlaps(in_file, out_dir, data):
     """Remove regions that overlap with next region, these result in issues with PureCN.
     """
+    import pandas as pd
     out_file = os.path.join(out_dir, "%s-nooverlaps%s" % utils.splitext_plus(os.path.basename(in_file)))
-    if not utils.file_uptodate(out_file, in_file):
-        with file_transaction(data, out_file) as tx_out_file:
-            with open(in_file) as in_handle:
-                with open(tx_out_file, "w") as out_handle:
-                    prev_line = None
-                    for line in in_handle:
-                        if prev_line:
-                            pchrom, pstart, pend = prev_line.split("\t", 4)[:3]
-                            cchrom, cstart, cend = line.split("\t", 4)[:3]
-                            # Skip if chromosomes match and end overlaps start
-                            if pchrom == cchrom and int(pend) > int(cstart):
-                                pass
-                            else:
-                                out_handle.write(prev_line)
-                        prev_line = line
-                    out_handle.write(prev_line)
+    fp_file = "%s.fp" % out_file
+    if not utils.file_uptodate(out_file, in_file) and not _fingerprint_matches(out_file, fp_file, in_file):
+        with file_transaction(data, out_file, fp_file) as (tx_out_file, tx_fp_file):
+            # Keep original text for all columns, only coordinates need numeric comparison
+            df = pd.read_csv(in_file, sep="\t", header=0, dtype=str, keep_default_na=False,
+                             na_filter=False, quoting=csv.QUOTE_NONE)
+            chroms = df.iloc[:, 0]
+            starts = df.iloc[:, 1].astype("int64")
+            ends = df.iloc[:, 2].astype("int64")
+            # Skip if chromosomes match and end overlaps start of next region
+            overlaps = (chroms == chroms.shift(-1)) & (ends > starts.shift(-1))
+            df[~overlaps].to_csv(tx_out_file, sep="\t", header=True, index=False,
+                                 quoting=csv.QUOTE_NONE)
+            with open(tx_fp_file, "w") as out_handle:
+                out_handle.write(_bed_fingerprint(in_file) + "\n")
     return out_file
 
+def _bed_fingerprint(in_file):
+    """Content fingerprint of an input file: size plus a blake2b digest of the contents.
+    """
+    digest = hashlib.blake2b()
+    with open(in_file, "rb") as in_handle:
+        for chunk in iter(functools.partial(in_handle.read, 1024 * 1024), b""):
+            digest.update(chunk)
+    return "%s\t%s" % (os.path.getsize(in_file), digest.hexdigest())
+
+def _fingerprint_matches(out_file, fp_file, in_file):
+    """Check if out_file was generated from identical in_file content.
+
+    Avoids regenerating outputs when inputs are rewritten or touched without changes.
+    The out_file timestamp is left alone so downstream steps do not see it as updated;
+    instead the sidecar is touched on a match, so later checks skip re-hashing.
+    """
+    if utils.file_exists(out_file) and os.path.exists(fp_file):
+        if utils.file_uptodate(fp_file, in_file):
+            return True
+        with open(fp_file) as in_handle:
+            if in_handle.read().strip() == _bed_fingerprint(in_file):
+                os.utime(fp_file)
+                return True
+    return False
+
 def _get_purecn_files(paired, work_dir, require_exist=False):
     """Retrieve organized structure of PureCN output files.
     """
-    out_base = os.path.join(work_dir, "%s-purecn" % (dd.get_sample_name(paired.tumor_data)))
+    out_base, plot_files, key_files = _purecn_file_names(work_dir, dd.get_sample_name(paired.tumor_data))
     out = {"plot": {}}
     all_files = []
-    for plot in ["chromosomes", "local_optima", "segmentation", "summary"]:
-        if plot == "summary":
-            cur_file = "%s.pdf" % out_base
-        else:
-            cur_file = "%s_%s.pdf" % (out_base, plot)
+    for plot, cur_file in plot_files:
         if not require_exist or os.path.exists(cur_file):
             out["plot"][plot] = cur_file
             all_files.append(os.path.basename(cur_file))
-    for key, ext in [["hetsummary", ".csv"], ["dnacopy", "_dnacopy.seg"], ["genes", "_genes.csv"],
-                     ["log", ".log"], ["loh", "_loh.csv"], ["rds", ".rds"],
-                     ["variants", "_variants.csv"]]:
-        cur_file = "%s%s" % (out_base, ext)
+    for key, cur_file in key_files:
         if not require_exist or os.path.exists(cur_file):
             out[key] = cur_file
             all_files.append(os.path.basename(cur_file))
     return out_base, out, all_files
 
+@functools.lru_cache(maxsize=None)
+def _purecn_file_names(work_dir, sample_name):
+    """Cached base name, plot and output files expected from a PureCN run.
+    """
+    prefix = os.path.join(work_dir, f"{sample_name}-purecn")
+    plot_files = tuple((p, f"{prefix}.pdf" if p == "summary" else f"{prefix}_{p}.pdf")
+                       for p in ["chromosomes", "local_optima", "segmentation", "summary"])
+    key_files = tuple((key, f"{prefix}{ext}")
+                      for key, ext in [["hetsummary", ".csv"], ["dnacopy", "_dnacopy.seg"],
+                                       ["genes", "_genes.csv"], ["log", ".log"], ["loh", "_loh.csv"],
+                                       ["rds", ".rds"], ["variants", "_variants.csv"]])
+    return prefix, plot_files, key_files
+
 def _sv_workdir(data):
     return utils.safe_makedir(os.path.join(dd.get_work_dir(data), "structural",
                                            dd.get_sample_name(data), "purecn"))
@@ -10,6 +10,7 @@ import copy
 import glob
 import math
 import os
+from concurrent import futures
 
 import yaml
 import toolz as tz
@@ -73,7 +74,7 @@ def combine_calls(*args):
         batch_id, ",".join(caller_names)))
     edata = copy.deepcopy(data)
     base_dir = utils.safe_makedir(os.path.join(edata["dirs"]["work"], "ensemble", batch_id))
-    if any([vcfutils.vcf_has_variants(f) for f in vrn_files]):
+    if _any_has_variants(vrn_files):
         # Decompose multiallelic variants and normalize
         passonly = not tz.get_in(["config", "algorithm", "ensemble", "use_filtered"], edata, False)
         vrn_files = [normalize.normalize(f, data, passonly=passonly, rerun_effects=False, remove_oldeffects=True,
@@ -109,19 +110,48 @@ def combine_calls(*args):
     else:
         return [[batch_id, callinfo]]
 
+def _any_has_variants(vrn_files):
+    """Check if any input VCF contains variants, probing files concurrently.
+
+    Checks are I/O bound reads of the start of each file, so overlap them using
+    threads. Returns on the first file with variants, cancelling pending checks
+    without waiting for running ones.
+    """
+    if not vrn_files:
+        return False
+    executor = futures.ThreadPoolExecutor(max_workers=min(8, len(vrn_files)))
+    checks = [executor.submit(vcfutils.vcf_has_variants, f) for f in vrn_files]
+    try:
+        for check in futures.as_completed(checks):
+            if check.result():
+                return True
+        return False
+    finally:
+        for check in checks:
+            check.cancel()
+        executor.shutdown(wait=False)
+
 def combine_calls_parallel(samples, run_parallel):
     """Combine calls using batched Ensemble approach.
     """
     batch_groups, extras = _group_by_batches(samples, _has_ensemble)
     out = []
     if batch_groups:
-        processed = run_parallel("combine_calls", ((b, xs, xs[0]) for b, xs in batch_groups.items()))
-        for batch_id, callinfo in processed:
-            for data in batch_groups[batch_id]:
-                data["variants"].insert(0, callinfo)
+        # Submit the most expensive batches first so they do not straggle at the end
+        # of the parallel run, then restore the original batch ordering for output
+        by_cost = sorted(batch_groups.items(), key=lambda x: _ensemble_cost(x[1]), reverse=True)
+        processed = dict(run_parallel("combine_calls", [(b, xs, xs[0]) for b, xs in by_cost]))
+        for batch_id, xs in batch_groups.items():
+            for data in xs:
+                data["variants"].insert(0, processed[batch_id])
                 out.append([data])
     return out + extras
 
+def _ensemble_cost(xs):
+    """Estimate relative work for ensembling a batch: samples times variant callers.
+    """
+    return len(xs) * len(xs[0]["variants"])
+
 def _has_ensemble(data):
     # for tumour-normal calling, a sample may have "ensemble" for the normal
     # sample configured but there won't be any variant files per se
@@ -145,19 +175,15 @@ def _group_by_batches(samples, check_fn):
 def _organize_variants(samples, batch_id):
     """Retrieve variant calls for all samples, merging batched samples into single VCF.
     """
-    caller_names = [x["variantcaller"] for x in samples[0]["variants"]]
-    calls = collections.defaultdict(list)
+    calls = collections.OrderedDict((x["variantcaller"], []) for x in samples[0]["variants"])
     for data in samples:
         for vrn in data["variants"]:
-            calls[vrn["variantcaller"]].append(vrn["vrn_file"])
-    data = samples[0]
-    vrn_files = []
-    for caller in caller_names:
-        fnames = calls[caller]
-        if len(fnames) == 1:
-            vrn_files.append(fnames[0])
-        else:
-            vrn_files.append(population.get_multisample_vcf(fnames, batch_id, caller, data))
+            if vrn["variantcaller"] in calls:
+                calls[vrn["variantcaller"]].append(vrn["vrn_file"])
+    caller_names = list(calls.keys())
+    vrn_files = [fnames[0] if len(fnames) == 1
+                 else population.get_multisample_vcf(fnames, batch_id, caller, samples[0])
+                 for caller, fnames in calls.items()]
     return caller_names, vrn_files
 
 def _handle_somatic_ensemble(vrn_file, data):
@@ -165,18 +191,18 @@ def _handle_somatic_ensemble(vrn_file, data):
 
     Only needed for bcbio.variation based ensemble calling.
     """
-    if tz.get_in(["metadata", "phenotype"], data, "").lower().startswith("tumor"):
-        vrn_file_temp = vrn_file.replace(".vcf", "_tumorOnly_noFilteredCalls.vcf")
-        # Select tumor sample and keep only PASS and . calls
-        vrn_file = vcfutils.select_sample(in_file=vrn_file, sample=data["name"][1],
-                                          out_file=vrn_file_temp,
-                                          config=data["config"], filters="PASS,.")
-    return vrn_file
+    base, ext = utils.splitext_plus(vrn_file)
+    vrn_file_temp = "%s_tumorOnly_noFilteredCalls%s" % (base, ext)
+    # Select tumor sample and keep only PASS and . calls
+    return vcfutils.select_sample(in_file=vrn_file, sample=data["name"][1],
+                                  out_file=vrn_file_temp,
+                                  config=data["config"], filters="PASS,.")
 
 def _bcbio_variation_ensemble(vrn_files, out_file, ref_file, config_file, base_dir, data):
     """Run a variant comparison using the bcbio.variation toolkit, given an input configuration.
     """
-    vrn_files = [_handle_somatic_ensemble(v, data) for v in vrn_files]
+    if tz.get_in(["metadata", "phenotype"], data, "").lower().startswith("tumor"):
+        vrn_files = [_handle_somatic_ensemble(v, data) for v in vrn_files]
     tmp_dir = utils.safe_makedir(os.path.join(base_dir, "tmp"))
     resources = config_utils.get_resources("bcbio_variation", data["config"])
     jvm_opts = resources.get("jvm_opts", ["-Xms750m", "-Xmx2g"])
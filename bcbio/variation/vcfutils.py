@@ -260,7 +260,11 @@ def select_sample(in_file, sample, out_file, config, filters=None):
                 bcftools = config_utils.get_program("bcftools", config)
                 output_type = "z" if out_file.endswith(".gz") else "v"
                 filter_str = "-f %s" % filters if filters is not None else ""  # filters could be e.g. 'PASS,.'
-                cmd = "{bcftools} view -O {output_type} {filter_str} {in_file} -s {sample} > {tx_out_file}"
+                # Extra threads only help with bgzip compressed output
+                cores = int(dd.get_num_cores({"config": config}))
+                threads_str = "--threads %s" % cores if cores > 1 and output_type == "z" else ""
+                cmd = ("{bcftools} view -O {output_type} {filter_str} {threads_str} {in_file} -s {sample} "
+                       "> {tx_out_file}")
                 do.run(cmd.format(**locals()), "Select sample: %s" % sample)
     if out_file.endswith(".gz"):
         bgzip_and_index(out_file, config)
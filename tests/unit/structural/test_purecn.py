@@ -0,0 +1,189 @@
+import os
+
+import pytest
+
+from bcbio.structural import purecn
+
+CNR = ("chromosome\tstart\tend\tgene\tlog2\tdepth\tweight\n"
+       "1\t100\t200\tnull\t0.1\t10.0\t1.0\n"
+       "1\t150\t300\t\"x,y\"\t-0.20\t12.5\t0.5\n"
+       "1\t300\t400\tNA\t1e-05\t0\t1\n"
+       "X\t50\t90\tGENE1\t0.3\t5.0\t1.0\n"
+       "X\t80\t120\ta\"b\t-1.5\t6.0\t1.0\n"
+       "Y\t10\t20\t-\t0.0\t7.0\t1.0\n")
+
+
+def _remove_overlaps_by_line(in_file, out_file):
+    """Previous line based implementation of _remove_overlaps, used as a reference.
+    """
+    with open(in_file) as in_handle:
+        with open(out_file, "w") as out_handle:
+            prev_line = None
+            for line in in_handle:
+                if prev_line:
+                    pchrom, pstart, pend = prev_line.split("\t", 4)[:3]
+                    cchrom, cstart, cend = line.split("\t", 4)[:3]
+                    if pchrom == cchrom and int(pend) > int(cstart):
+                        pass
+                    else:
+                        out_handle.write(prev_line)
+                prev_line = line
+            out_handle.write(prev_line)
+
+
+def test_remove_overlaps_matches_line_based_output(tmpdir):
+    in_file = str(tmpdir.join("sample.cnr"))
+    with open(in_file, "w") as out_handle:
+        out_handle.write(CNR)
+    expected_file = str(tmpdir.join("expected.cnr"))
+    _remove_overlaps_by_line(in_file, expected_file)
+
+    out_file = purecn._remove_overlaps(in_file, str(tmpdir), {})
+    assert os.path.basename(out_file) == "sample-nooverlaps.cnr"
+    with open(out_file) as in_handle:
+        out = in_handle.read()
+    with open(expected_file) as in_handle:
+        assert out == in_handle.read()
+
+
+GATK_HEADER = ("@HD\tVN:1.6\n"
+               "@SQ\tSN:1\tLN:249250621\tUR:file:/ref/GRCh37.fa\n"
+               "@SQ\tSN:X\tLN:155270560\tUR:file:/ref/GRCh37.fa\n"
+               "@RG\tID:GATKCopyNumber\tSM:tumor\n")
+
+# Enough numeric contig rows that type inference only samples chromosome 1
+BINS = [("1", i * 100, i * 100 + 50, "GENE%s" % i, "%s.5" % i) for i in range(1, 151)] + \
+       [("X", 500, 600, "GENEX", "30.25")]
+
+DENOISED_CR = (GATK_HEADER + "CONTIG\tSTART\tEND\tLOG2_COPY_RATIO\n" +
+               "".join("%s\t%s\t%s\t-0.125\n" % b[:3] for b in BINS))
+
+COVERAGE = "".join("%s\t%s\t%s\t%s\t%s\t%s\n" % (chrom, start, end, gene, depth, gene)
+                   for chrom, start, end, gene, depth in BINS)
+
+EXPECTED_CNR = ("chrom\tstart\tend\tgene\tlog2\tdepth\tweight\n" +
+                "".join("%s\t%s\t%s\t%s\t-0.125\t%s\t1.0\n" % b for b in BINS))
+
+
+def _write_inputs(tmpdir):
+    cnr_file = str(tmpdir.join("tumor.denoisedCR.tsv"))
+    with open(cnr_file, "w") as out_handle:
+        out_handle.write(DENOISED_CR)
+    cov_file = str(tmpdir.join("tumor-coverage.bed"))
+    with open(cov_file, "w") as out_handle:
+        out_handle.write(COVERAGE)
+    return cnr_file, cov_file
+
+
+@pytest.mark.parametrize("use_arrow", [True, False])
+@pytest.mark.parametrize("rows,expected", [
+    ("1\t100\t400\t2\t-0.1875\nX\t500\t600\t1\t1.0\n", [("1", 400, -0.1875), ("X", 600, 1.0)]),
+    ("", [])])
+def test_read_tsv_skips_gatk_header(tmpdir, mocker, use_arrow, rows, expected):
+    if use_arrow:
+        pytest.importorskip("pyarrow")
+    else:
+        mocker.patch.object(purecn, "_has_arrow_engine", return_value=False)
+    seg_file = str(tmpdir.join("tumor.cr.seg"))
+    with open(seg_file, "w") as out_handle:
+        out_handle.write(GATK_HEADER +
+                         "CONTIG\tSTART\tEND\tNUM_POINTS_COPY_RATIO\tMEAN_LOG2_COPY_RATIO\n" +
+                         rows)
+    names = ["chrom", "loc.start", "loc.end", "num.mark", "seg.mean"]
+    df = purecn._read_tsv(seg_file, comment="@", names=names)
+    assert list(df.columns) == names
+    assert list(zip(df["chrom"], df["loc.end"], df["seg.mean"])) == expected
+
+
+@pytest.mark.parametrize("use_arrow", [True, False])
+def test_normalize_cnr_pandas(tmpdir, mocker, use_arrow):
+    if use_arrow:
+        pytest.importorskip("pyarrow")
+    else:
+        mocker.patch.object(purecn, "_has_arrow_engine", return_value=False)
+    cnr_file, cov_file = _write_inputs(tmpdir)
+    out_file = str(tmpdir.join("tumor.cnr"))
+    purecn._normalize_cnr_pandas(cnr_file, cov_file, out_file)
+    with open(out_file) as in_handle:
+        assert in_handle.read() == EXPECTED_CNR
+
+
+def test_normalize_cnr_polars(tmpdir):
+    pytest.importorskip("polars")
+    cnr_file, cov_file = _write_inputs(tmpdir)
+    out_file = str(tmpdir.join("tumor.cnr"))
+    purecn._normalize_cnr_polars(cnr_file, cov_file, out_file)
+    with open(out_file) as in_handle:
+        assert in_handle.read() == EXPECTED_CNR
+
+
+def test_segment_normalized_gatk_polars_flag(tmpdir, mocker):
+    pytest.importorskip("polars")
+    cnr_file, cov_file = _write_inputs(tmpdir)
+    seg_file = str(tmpdir.join("tumor.cr.seg"))
+    with open(seg_file, "w") as out_handle:
+        out_handle.write(GATK_HEADER +
+                         "CONTIG\tSTART\tEND\tNUM_POINTS_COPY_RATIO\tMEAN_LOG2_COPY_RATIO\n"
+                         "X\t500\t600\t1\t1.0\n")
+    mocker.patch("bcbio.structural.gatkcnv.model_segments", return_value={"seg": seg_file})
+    polars_normalize = mocker.spy(purecn, "_normalize_cnr_polars")
+    tumor = {"rgnames": {"sample": "tumor"}, "dirs": {"work": str(tmpdir)},
+             "config": {"algorithm": {"tools_on": ["purecn_polars"]}},
+             "depth": {"bins": {"antitarget": cov_file}}}
+    paired = mocker.Mock(tumor_data=tumor)
+    std_cnr_file, std_seg_file = purecn._segment_normalized_gatk(cnr_file, str(tmpdir), paired)
+    assert polars_normalize.call_count == 1
+    with open(std_cnr_file) as in_handle:
+        assert in_handle.read() == EXPECTED_CNR
+    with open(std_seg_file) as in_handle:
+        assert in_handle.read() == ("ID\tchrom\tloc.start\tloc.end\tnum.mark\tseg.mean\n"
+                                    "tumor\tX\t500\t600\t1\t1.0\n")
+
+
+def test_remove_overlaps_skips_touched_unchanged_input(tmpdir, mocker):
+    in_file = str(tmpdir.join("sample.cnr"))
+    with open(in_file, "w") as out_handle:
+        out_handle.write(CNR)
+    out_file = purecn._remove_overlaps(in_file, str(tmpdir), {})
+    assert os.path.exists(out_file + ".fp")
+    # Simulate touching the input after the output was generated
+    out_mtime = os.path.getmtime(in_file) - 100
+    os.utime(out_file, (out_mtime, out_mtime))
+    os.utime(out_file + ".fp", (out_mtime, out_mtime))
+
+    fingerprint = mocker.spy(purecn, "_bed_fingerprint")
+    mocker.patch("pandas.read_csv", side_effect=AssertionError("input should not be re-parsed"))
+    assert purecn._remove_overlaps(in_file, str(tmpdir), {}) == out_file
+    assert fingerprint.call_count == 1
+    # Output timestamp untouched, so downstream segmentation is not re-triggered
+    assert os.path.getmtime(out_file) == out_mtime
+    # Sidecar refreshed, so later calls skip on mtime alone without hashing again
+    purecn._remove_overlaps(in_file, str(tmpdir), {})
+    assert fingerprint.call_count == 1
+    assert os.path.getmtime(out_file) == out_mtime
+
+
+@pytest.mark.parametrize("version,supported", [("0.20.30", False), ("0.20.31", True),
+                                               ("1.0.0rc1", True)])
+def test_polars_supported_version(mocker, version, supported):
+    mocker.patch.object(purecn, "_has_module", return_value=True)
+    mocker.patch.dict("sys.modules", {"polars": mocker.Mock(__version__=version)})
+    assert purecn._polars_supported() == supported
+
+
+def test_segment_normalized_gatk_old_polars_uses_pandas(tmpdir, mocker):
+    cnr_file, cov_file = _write_inputs(tmpdir)
+    seg_file = str(tmpdir.join("tumor.cr.seg"))
+    with open(seg_file, "w") as out_handle:
+        out_handle.write(GATK_HEADER +
+                         "CONTIG\tSTART\tEND\tNUM_POINTS_COPY_RATIO\tMEAN_LOG2_COPY_RATIO\n")
+    mocker.patch("bcbio.structural.gatkcnv.model_segments", return_value={"seg": seg_file})
+    mocker.patch.object(purecn, "_polars_supported", return_value=False)
+    polars_normalize = mocker.patch.object(purecn, "_normalize_cnr_polars")
+    tumor = {"rgnames": {"sample": "tumor"}, "dirs": {"work": str(tmpdir)},
+             "config": {"algorithm": {"tools_on": ["purecn_polars"]}},
+             "depth": {"bins": {"antitarget": cov_file}}}
+    std_cnr_file, _ = purecn._segment_normalized_gatk(cnr_file, str(tmpdir), mocker.Mock(tumor_data=tumor))
+    assert polars_normalize.call_count == 0
+    with open(std_cnr_file) as in_handle:
+        assert in_handle.read() == EXPECTED_CNR